@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Request-level tests for sessions, caching headers and QR rendering
+"""
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# A throwaway SQLite file per run; must be set before app is imported
+os.environ["DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+import pytest
+import segno
+from fastapi.testclient import TestClient
+
+import app as chatcode
+
+PASSWORD = "secret1"
+
+def register(username: str, phone: str = "+77011234567") -> TestClient:
+    """A client signed in as a freshly registered user"""
+    client = TestClient(chatcode.app)
+    r = client.post("/register", data={"username": username, "password": PASSWORD, "phone": phone}, follow_redirects=False)
+    assert r.status_code == 303
+    return client
+
+def admin_client() -> TestClient:
+    client = TestClient(chatcode.app)
+    r = client.post("/login", data={"username": "admin", "password": "admin123"}, follow_redirects=False)
+    assert r.status_code == 303
+    return client
+
+def user_id(username: str) -> int:
+    return chatcode.get_public_user(username).id
+
+def test_session_cookie_round_trip():
+    """A cookie we issue reads back as its user id and password version"""
+    cookie = chatcode.create_session_cookie(42, "hash")
+    assert chatcode.read_session_cookie(cookie) == (42, chatcode.session_version("hash"))
+    # Flipping any character breaks the signature
+    tampered = cookie[:-1] + ("A" if cookie[-1] != "A" else "B")
+    assert chatcode.read_session_cookie(tampered) is None
+
+def test_legacy_cookie_still_accepted():
+    client = register("legacy_user")
+    legacy = chatcode.signer.sign(str(user_id("legacy_user"))).decode()
+    client.cookies.clear()
+    client.cookies.set("session", legacy)
+    assert client.get("/dashboard", follow_redirects=False).status_code == 200
+
+def test_password_change_invalidates_sessions():
+    client = register("rotating")
+    assert client.get("/dashboard", follow_redirects=False).status_code == 200
+    admin = admin_client()
+    r = admin.post(f"/admin/users/{user_id('rotating')}/update", data={
+        "username": "rotating", "phone": "+77011234567", "password": "changed1", "is_active": "true",
+    }, follow_redirects=False)
+    assert r.status_code == 303
+    r = client.get("/dashboard", follow_redirects=False)
+    assert r.status_code == 307 and r.headers["location"] == "/login"
+
+def test_login_rate_limited_after_failures():
+    register("guessed")
+    client = TestClient(chatcode.app)
+    for _ in range(chatcode.LOGIN_MAX_FAILURES):
+        assert client.post("/login", data={"username": "guessed", "password": "wrong"}).status_code == 401
+    # Even the right password is refused until the window passes
+    assert client.post("/login", data={"username": "guessed", "password": PASSWORD}).status_code == 429
+
+def test_etag_revalidation_returns_304():
+    client = register("etagged")
+    for path in ("/u/etagged", "/qr.png?u=etagged", "/qr.svg?u=etagged"):
+        etag = client.get(path).headers["etag"]
+        r = client.get(path, headers={"If-None-Match": etag})
+        assert r.status_code == 304 and r.content == b""
+        assert client.get(path, headers={"If-None-Match": '"stale"'}).status_code == 200
+    # Both encodings of the public page share one tag, so it must be weak
+    assert client.get("/u/etagged").headers["etag"].startswith("W/")
+
+def test_png_matches_segno_matrix():
+    """Decode the hand-written 1-bit PNG and compare every module with segno's matrix"""
+    link = chatcode.wa_link("+77011234567", "Hi")
+    png, scale, border = chatcode._qr_png(link), 10, 4
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    chunks, pos = {}, 8
+    while pos < len(png):
+        length, tag = struct.unpack(">I4s", png[pos:pos + 8])
+        data = png[pos + 8:pos + 8 + length]
+        assert struct.unpack(">I", png[pos + 8 + length:pos + 12 + length])[0] == zlib.crc32(tag + data)
+        chunks[tag] = data
+        pos += 12 + length
+    width, height, depth, color = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    matrix = segno.make_qr(link, error="m").matrix
+    assert width == height == (len(matrix) + 2 * border) * scale
+    assert (depth, color) == (1, 0)
+
+    raw = zlib.decompress(chunks[b"IDAT"])
+    stride = 1 + (width + 7) // 8
+    assert len(raw) == stride * height
+
+    def pixel(x: int, y: int) -> int:
+        line = raw[y * stride:(y + 1) * stride]
+        assert line[0] == 0  # no filter
+        return (line[1 + x // 8] >> (7 - x % 8)) & 1
+
+    for row, modules in enumerate(matrix):
+        for col, dark in enumerate(modules):
+            x, y = (col + border) * scale + scale // 2, (row + border) * scale + scale // 2
+            assert pixel(x, y) == (0 if dark else 1)
+    # The quiet zone is white
+    assert pixel(0, 0) == 1 and pixel(width - 1, height - 1) == 1
+
+def test_admin_users_paged_and_searched(monkeypatch):
+    for name in ("page_a", "page_b", "page_c"):
+        register(name)
+    monkeypatch.setattr(chatcode, "ADMIN_PAGE_SIZE", 2)
+    admin = admin_client()
+    first = admin.get("/admin/users?q=page_").text
+    assert "page_c" in first and "page_b" in first and "page_a" not in first
+    assert "Page 1 of 2 (3 users)" in first
+    assert "page_a" in admin.get("/admin/users?q=page_&page=2").text
+    # LIKE wildcards in the query are matched literally
+    assert "page_a" not in admin.get("/admin/users?q=%25").text
+
+def test_rehash_only_upgrades_weaker_hashes(monkeypatch):
+    monkeypatch.setattr(chatcode, "BCRYPT_ROUNDS", 10)
+    salt = "$" + "a" * 53
+    assert not chatcode.password_needs_rehash("$2b$12" + salt)
+    assert not chatcode.password_needs_rehash("$2b$10" + salt)
+    assert chatcode.password_needs_rehash("$2b$08" + salt)
+    assert chatcode.password_needs_rehash("$2a$12" + salt)
+
+def test_login_keeps_stronger_hash(monkeypatch):
+    register("strong_hash")
+    uid = user_id("strong_hash")
+    strong = chatcode.bcrypt.hashpw(PASSWORD.encode(), chatcode.bcrypt.gensalt(rounds=6)).decode()
+    with chatcode.Session(chatcode.engine) as s:
+        s.execute(chatcode.update(chatcode.User).where(chatcode.User.id == uid).values(password_hash=strong))
+        s.commit()
+    monkeypatch.setattr(chatcode, "BCRYPT_ROUNDS", 5)
+    client = TestClient(chatcode.app)
+    assert client.post("/login", data={"username": "strong_hash", "password": PASSWORD}, follow_redirects=False).status_code == 303
+    with chatcode.Session(chatcode.engine) as s:
+        assert s.get(chatcode.User, uid).password_hash == strong
+
+def run_app(db_path: str, code: str, **env) -> subprocess.CompletedProcess:
+    """Import the app in a fresh interpreter against db_path and run code"""
+    return subprocess.run(
+        [sys.executable, "-c", "import app; from fastapi.testclient import TestClient; " + code],
+        cwd=project_root, capture_output=True, text=True,
+        env={**os.environ, "DB_URL": f"sqlite:///{db_path}", **env},
+    )
+
+def test_read_engine_works_on_rollback_journal_database(tmp_path):
+    """The read-only engine must not try to switch a non-WAL file to WAL"""
+    db_path = str(tmp_path / "legacy.db")
+    assert run_app(db_path, "pass").returncode == 0
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0] == "delete"
+    result = run_app(db_path, (
+        "assert app.get_public_user('admin') is not None; "
+        "assert TestClient(app.app).get('/health?force=1').json()['database'] == 'OK'"
+    ), DB_AUTOCREATE="0")
+    assert result.returncode == 0, result.stderr
+    # Startup converts the file through the writer even without DB_AUTOCREATE
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+class StubOAuthClient:
+    """Stands in for an authlib GitHub client; counts code exchanges"""
+    class framework:
+        @staticmethod
+        async def get_state_data(session, state):
+            return {}
+
+        @staticmethod
+        async def clear_state_data(session, state):
+            pass
+
+    def __init__(self):
+        self.exchanges = 0
+
+    async def fetch_access_token(self, **kwargs):
+        self.exchanges += 1
+        await asyncio.sleep(0.1)
+        return {"access_token": "t"}
+
+    async def get(self, url, token):
+        data = [{"email": "octo@example.com", "primary": True}] if url.endswith("emails") else {"id": 99, "login": "octo"}
+        return httpx.Response(200, json=data)
+
+def test_concurrent_oauth_callbacks_share_one_exchange(monkeypatch):
+    client = StubOAuthClient()
+    monkeypatch.setitem(chatcode._OAUTH_CLIENTS, "github", client)
+    monkeypatch.setitem(chatcode._REDIRECT_URIS, "github", "http://test/auth/github/callback")
+    monkeypatch.setattr(chatcode, "verify_oauth_state", lambda request, state: True)
+
+    async def callbacks():
+        transport = httpx.ASGITransport(app=chatcode.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*[http.get("/auth/github/callback?state=S&code=C") for _ in range(3)])
+
+    responses = asyncio.run(callbacks())
+    assert [r.headers["location"] for r in responses] == ["/dashboard"] * 3
+    assert client.exchanges == 1
+    assert chatcode._oauth_inflight == {}
+    assert chatcode.get_public_user("octo") is not None
+
+def test_backup_includes_uncheckpointed_commits(tmp_path, monkeypatch):
+    """Rows still in the -wal file must make it into the backup"""
+    register("backed_up")
+    monkeypatch.chdir(tmp_path)
+    r = admin_client().post("/admin/system/backup-db").json()
+    assert r["success"], r["message"]
+    backup = next(tmp_path.glob("qr_backup_*.db"))
+    with sqlite3.connect(backup) as conn:
+        assert conn.execute("SELECT 1 FROM user WHERE username = 'backed_up'").fetchone()
+
+def test_parallel_wrong_guesses_all_count():
+    """A concurrent burst of guesses must not share one counter read"""
+    register("burst")
+    client = TestClient(chatcode.app)
+
+    def guess(_):
+        return client.post("/login", data={"username": "burst", "password": "wrong"}).status_code
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        codes = list(pool.map(guess, range(40)))
+    assert codes.count(401) == chatcode.LOGIN_MAX_FAILURES
+    assert codes.count(429) == 40 - chatcode.LOGIN_MAX_FAILURES
+
+def test_failed_last_login_flush_is_requeued(monkeypatch):
+    chatcode.queue_last_login(1, "2020-01-01T00:00:00")
+
+    class BrokenEngine:
+        def begin(self):
+            # A login lands while the batch is being written, then the write fails
+            chatcode.queue_last_login(1, "2021-01-01T00:00:00")
+            raise chatcode.OperationalError("UPDATE", {}, Exception("database is locked"))
+
+    with monkeypatch.context() as m:
+        m.setattr(chatcode, "engine", BrokenEngine())
+        with pytest.raises(chatcode.OperationalError):
+            chatcode.flush_last_logins()
+    # The requeued batch doesn't overwrite the newer login
+    assert chatcode._pending_logins[1] == "2021-01-01T00:00:00"
+    chatcode.flush_last_logins()
+    assert chatcode._pending_logins == {}
+    with chatcode.Session(chatcode.engine) as s:
+        assert s.get(chatcode.User, 1).last_login == "2021-01-01T00:00:00"
+
+def test_compressed_bodies_get_their_own_etag():
+    """Gzip and identity bodies are different bytes, so they can't share a strong ETag"""
+    register("gz_tagged")
+    client = TestClient(chatcode.app)
+    for path in ("/qr.svg?u=gz_tagged", f"/static/base.css?v={chatcode.BASE_CSS_VERSION}"):
+        gz = client.get(path, headers={"Accept-Encoding": "gzip"})
+        plain = client.get(path, headers={"Accept-Encoding": "identity"})
+        assert gz.headers["content-encoding"] == "gzip" and "content-encoding" not in plain.headers
+        assert gz.content == plain.content
+        assert gz.headers["etag"] != plain.headers["etag"]
+        r = client.get(path, headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["etag"]})
+        assert r.status_code == 200 and r.content == plain.content
+    # PNG is already deflated and goes out as stored
+    assert "content-encoding" not in client.get("/qr.png?u=gz_tagged", headers={"Accept-Encoding": "gzip"}).headers
+
+def test_rehash_login_releases_read_connection(monkeypatch):
+    """On Postgres both sessions share one pool, so the read must be returned before the write"""
+    register("rehashed")
+    monkeypatch.setattr(chatcode, "BCRYPT_ROUNDS", 5)
+    hash_password, held = chatcode.hash_password, []
+
+    def spy(password):
+        held.append(chatcode.read_engine.pool.checkedout())
+        return hash_password(password)
+
+    monkeypatch.setattr(chatcode, "hash_password", spy)
+    client = TestClient(chatcode.app)
+    assert client.post("/login", data={"username": "rehashed", "password": PASSWORD}, follow_redirects=False).status_code == 303
+    assert held == [0]
+
+def test_admin_edit_form_escapes_user_fields():
+    register("edited")
+    uid = user_id("edited")
+    payload = '"><script>alert(1)</script>'
+    with chatcode.Session(chatcode.engine) as s:
+        s.execute(chatcode.update(chatcode.User).where(chatcode.User.id == uid).values(
+            username="edited" + payload, preset_text="</textarea>" + payload))
+        s.commit()
+    chatcode.forget_user(uid)
+    html = admin_client().get(f"/admin/users/{uid}/edit").text
+    assert "<script>alert(1)" not in html and "</textarea>\"><" not in html
+    assert "&lt;script&gt;alert(1)" in html
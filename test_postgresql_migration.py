@@ -169,7 +169,7 @@ def test_qr_generation():
     print("\n📱 Testing QR code generation...")
     
     try:
-        import qrcode
+        import segno
         from io import BytesIO
         
         # Test QR code generation
@@ -183,15 +183,11 @@ def test_qr_generation():
             wa_url += f"?text={urllib.parse.quote(preset)}"
         
         # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(wa_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
+        qr = segno.make_qr(wa_url, error="m")
         
         # Save to BytesIO to test
         img_io = BytesIO()
-        img.save(img_io, 'PNG')
+        qr.save(img_io, kind="png", scale=10, border=5)
         img_data = img_io.getvalue()
         
         if len(img_data) > 100:  # Should be a reasonable size PNG (lowered threshold)